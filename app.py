@@ -4,11 +4,18 @@ import sounddevice as sd
 import soundfile as sf
 from datetime import datetime
 import os
-from openai import OpenAI
+import json
+import asyncio
+import hashlib
+from openai import AsyncOpenAI, OpenAI
 import pandas as pd
-import time 
+import time
 import logging
 import sys
+from collections import deque
+import ctranslate2
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+import config
 
 # Setup logging
 logging.basicConfig(
@@ -37,17 +44,81 @@ def get_openai_client():
 client = get_openai_client()
 
 # Initialize Whisper model
-# @st.cache_resource
-# def load_whisper_model():
-#     return whisper.load_model("base")
+@st.cache_resource
+def load_whisper_model():
+    """Load the faster-whisper model, quantized for the available device"""
+    if ctranslate2.get_cuda_device_count() > 0:
+        device, compute_type = "cuda", config.WHISPER_GPU_COMPUTE_TYPE
+    else:
+        device, compute_type = "cpu", config.WHISPER_CPU_COMPUTE_TYPE
+    logger.info(f"Loading Whisper model '{config.WHISPER_MODEL}' on {device} ({compute_type})")
+    whisper_model = WhisperModel(config.WHISPER_MODEL, device=device, compute_type=compute_type,
+                                 cpu_threads=config.WHISPER_CPU_THREADS)
+    # VAD splits the audio into speech chunks that are decoded in batches
+    return BatchedInferencePipeline(model=whisper_model)
 
-# model = load_whisper_model()
+model = load_whisper_model()
 
-def generate_meeting_summary(transcript):
-    """Generate comprehensive meeting summary and detailed mermaid diagram"""
-    logger.info("Generating meeting summary")
-    prompt = f"""
-    Analyze the following meeting transcript and provide a comprehensive analysis with:
+def audio_hash(audio_file):
+    """Hash the audio content, used as the key for cached results"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(audio_file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_cached_result(key):
+    """Load the cached transcript and analysis for an audio hash"""
+    path = config.CACHE_DIR / f"{key}.json"
+    if not path.exists():
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cache entry {path}: {str(e)}")
+        return {}
+
+def update_cached_result(key, **fields):
+    """Persist transcript/analysis fields for an audio hash"""
+    cached = load_cached_result(key)
+    cached.update(fields)
+    try:
+        with open(config.CACHE_DIR / f"{key}.json", "w") as f:
+            json.dump(cached, f)
+    except Exception as e:
+        logger.warning(f"Error writing cache entry {key}: {str(e)}")
+
+def transcribe_audio(audio_file, cache_key):
+    """Transcribe an audio file with the local Whisper model"""
+    cached = load_cached_result(cache_key)
+    if 'transcript' in cached and cached.get('transcript_model') == config.WHISPER_MODEL:
+        logger.info(f"Using cached transcript for {audio_file}")
+        return cached['transcript']
+
+    logger.info(f"Transcribing audio: {audio_file}")
+    try:
+        # vad_filter runs Silero VAD and only decodes speech regions, so leading,
+        # trailing and in-between silence never reaches the encoder
+        segments, _ = model.transcribe(audio_file,
+                                       batch_size=config.WHISPER_BATCH_SIZE,
+                                       beam_size=config.WHISPER_BEAM_SIZE,
+                                       vad_filter=True)
+        transcript = " ".join(segment.text.strip() for segment in segments)
+        logger.info("Transcription completed successfully")
+        update_cached_result(cache_key, transcript=transcript, transcript_model=config.WHISPER_MODEL)
+        return transcript
+    except Exception as e:
+        logger.error(f"Error transcribing audio: {str(e)}")
+        raise
+
+# Static instructions live in the system message so repeated requests share the same prefix
+SUMMARY_SYSTEM_PROMPT = """You are an expert meeting analyzer specializing in creating comprehensive visual representations of meetings.
+    Always ensure the Mermaid diagram code is valid and starts with 'graph TD'.
+    Use simple shapes and clear connections in the diagram.
+    Avoid complex Mermaid syntax that might not be widely supported.
+
+    Analyze the meeting transcript you are given and provide a comprehensive analysis with:
     1. A concise executive summary
     2. Detailed action items with assignees and deadlines
     3. A detailed Mermaid diagram that shows:
@@ -74,80 +145,243 @@ def generate_meeting_summary(transcript):
             C --> D((John))
             style B fill:#ff9999,stroke:#000,stroke-width:2px
             style D fill:#99ff99,stroke:#000,stroke-width:2px
-
-
-    Transcript:
-    {transcript}
     
     Format the response as JSON with the following structure:
-    {{
+    {
         "executive_summary": "brief but comprehensive summary",
         "action_items": [
-            {{
+            {
                 "task": "task description",
                 "assignee": "person name",
                 "deadline": "deadline or timeframe",
                 "priority": "high/medium/low",
                 "dependencies": ["any dependencies"]
-            }}
+            }
         ],
         "key_decisions": ["list of key decisions made"],
         "mermaid_diagram": "mermaid diagram code here"
-    }}
-    """
-    
+    }"""
+
+# Short transcripts don't need the full rule set, which would dwarf the content
+COMPACT_SUMMARY_SYSTEM_PROMPT = """You are a meeting analyzer. Respond with a JSON object with the keys:
+    executive_summary (string), action_items (list of objects with task, assignee, deadline,
+    priority high/medium/low and dependencies list), key_decisions (list of strings) and
+    mermaid_diagram (a small valid Mermaid diagram starting with 'graph TD', without
+    parentheses or special characters in node names)."""
+
+# Several meetings per request always get the full rules plus the results wrapper
+BATCH_SUMMARY_SYSTEM_PROMPT = SUMMARY_SYSTEM_PROMPT + """
+
+    You will be given several separate meeting transcripts, numbered from 1.
+    Analyze each meeting on its own and respond with a JSON object of the form
+    {"results": [...]} holding exactly one analysis per meeting, in the same order,
+    each using the JSON structure described above."""
+
+def is_short_transcript(transcript):
+    """Check whether a transcript is short enough for the compact prompt"""
+    return len(transcript.split()) < config.SHORT_TRANSCRIPT_WORDS
+
+def build_summary_messages(transcript):
+    """Build the chat messages asking for a meeting summary and mermaid diagram"""
+    if is_short_transcript(transcript):
+        system_prompt = COMPACT_SUMMARY_SYSTEM_PROMPT
+    else:
+        system_prompt = SUMMARY_SYSTEM_PROMPT
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Transcript:\n{transcript}"}
+    ]
+
+ANALYSIS_KEYS = ('executive_summary', 'action_items', 'key_decisions', 'mermaid_diagram')
+
+def is_valid_analysis(analysis):
+    """Check that an analysis has every key the dashboard reads"""
+    return isinstance(analysis, dict) and all(key in analysis for key in ANALYSIS_KEYS)
+
+# Cached analyses from another model or prompt revision are regenerated
+ANALYSIS_VERSION = hashlib.blake2b(
+    "\n".join([config.GPT_MODEL, SUMMARY_SYSTEM_PROMPT, COMPACT_SUMMARY_SYSTEM_PROMPT,
+               BATCH_SUMMARY_SYSTEM_PROMPT]).encode(),
+    digest_size=8
+).hexdigest()
+
+def load_cached_analysis(key):
+    """Load the cached analysis for an audio hash if it matches the current prompts"""
+    cached = load_cached_result(key)
+    if cached.get('analysis_version') != ANALYSIS_VERSION:
+        return None
+    analysis = cached.get('analysis')
+    return analysis if is_valid_analysis(analysis) else None
+
+def save_cached_analysis(key, analysis):
+    """Persist an analysis for an audio hash, tagged with the current prompt version"""
+    update_cached_result(key, analysis=analysis, analysis_version=ANALYSIS_VERSION)
+
+def numbered_transcripts(transcripts):
+    """Join several transcripts into one numbered text"""
+    return "\n\n".join(f"Meeting {idx}:\n{transcript}" for idx, transcript in enumerate(transcripts, 1))
+
+def build_batch_summary_messages(transcripts):
+    """Build the chat messages asking for one meeting summary per transcript"""
+    return [
+        {"role": "system", "content": BATCH_SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": f"{len(transcripts)} transcripts:\n\n{numbered_transcripts(transcripts)}"}
+    ]
+
+def generate_meeting_summary(transcript):
+    """Generate comprehensive meeting summary and detailed mermaid diagram"""
+    logger.info("Generating meeting summary")
     response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": """You are an expert meeting analyzer specializing in creating comprehensive visual representations of meetings.
-            Always ensure the Mermaid diagram code is valid and starts with 'graph TD'.
-            Use simple shapes and clear connections in the diagram.
-            Avoid complex Mermaid syntax that might not be widely supported."""},
-            {"role": "user", "content": prompt}
-        ],
-        response_format={ "type": "json_object" }
+        model=config.GPT_MODEL,
+        messages=build_summary_messages(transcript),
+        response_format={ "type": "json_object" },
+        stream=True,
+        seed=config.SUMMARY_SEED
     )
     
+    # Render tokens as they arrive, throttled so the UI isn't resent the buffer per token;
+    # the JSON is only parsed once complete
+    placeholder = st.empty()
+    parts = []
+    finish_reason = None
+    last_render = time.monotonic()
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        finish_reason = chunk.choices[0].finish_reason or finish_reason
+        if chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            if time.monotonic() - last_render >= config.STREAM_RENDER_INTERVAL:
+                placeholder.code("".join(parts), language="json")
+                last_render = time.monotonic()
+    placeholder.empty()
+    
+    if finish_reason == "length":
+        logger.error("Meeting summary was cut off at the token limit")
+        raise ValueError("The meeting summary was cut off at the model's token limit")
+    
     logger.info("Meeting summary generated successfully")
-    return response.choices[0].message.content
+    return "".join(parts)
+
+async def analyze_many(transcripts):
+    """Generate meeting summaries for several transcripts concurrently"""
+    logger.info(f"Generating meeting summaries for {len(transcripts)} transcripts")
+    # Bound in-flight requests to stay within the OpenAI rate limits
+    semaphore = asyncio.Semaphore(config.OPENAI_MAX_CONCURRENT_REQUESTS)
+    # Several meetings share one request to cut the number of requests per minute
+    batches = [transcripts[i:i + config.SUMMARY_BATCH_SIZE]
+               for i in range(0, len(transcripts), config.SUMMARY_BATCH_SIZE)]
+
+    async with AsyncOpenAI(api_key=client.api_key) as async_client:
+        async def analyze(batch):
+            async with semaphore:
+                try:
+                    response = await async_client.chat.completions.create(
+                        model=config.GPT_MODEL,
+                        messages=build_batch_summary_messages(batch),
+                        response_format={ "type": "json_object" },
+                        seed=config.SUMMARY_SEED
+                    )
+                    if response.choices[0].finish_reason == "length":
+                        raise ValueError("Meeting summaries were cut off at the model's token limit")
+                    results = json.loads(response.choices[0].message.content)["results"]
+                    if len(results) != len(batch):
+                        raise ValueError(f"Expected {len(batch)} results, got {len(results)}")
+                    invalid = sum(not is_valid_analysis(result) for result in results)
+                    if invalid:
+                        logger.error(f"Dropping {invalid} malformed meeting summaries")
+                    return [result if is_valid_analysis(result) else None for result in results]
+                except Exception as e:
+                    logger.error(f"Error generating meeting summaries: {str(e)}")
+                    return [None] * len(batch)
+
+        batch_results = await asyncio.gather(*[analyze(batch) for batch in batches])
+
+    logger.info("Meeting summaries generated successfully")
+    return [result for results in batch_results for result in results]
 
 def record_audio_stream():
     """Record audio stream until stopped"""
     logger.info("Starting audio stream recording")
+    max_frames = int(config.AUDIO_SAMPLE_RATE * 3600 * config.MAX_RECORDING_HOURS)
+    # Blocks are appended as they arrive instead of filling a preallocated buffer
+    recorder = {"stream": None, "blocks": deque(), "frames": 0}
+
+    def callback(indata, frames, time_info, status):
+        if status:
+            logger.warning(f"Audio stream status: {status}")
+        recorder['blocks'].append(indata.copy())
+        recorder['frames'] += frames
+        if recorder['frames'] >= max_frames:  # Record up to MAX_RECORDING_HOURS
+            raise sd.CallbackStop
+
     try:
-        return sd.rec(int(44100 * 3600),  # Record up to 1 hour
-                     samplerate=44100,
-                     channels=1,
-                     dtype='float64')
+        # Record 16 kHz int16 PCM, the native input format of Whisper
+        stream = sd.InputStream(samplerate=config.AUDIO_SAMPLE_RATE,
+                                channels=config.AUDIO_CHANNELS,
+                                dtype='int16',
+                                blocksize=config.AUDIO_BLOCK_SIZE,
+                                callback=callback)
+        stream.start()
+        recorder['stream'] = stream
+        return recorder
     except Exception as e:
         logger.error(f"Error starting audio recording: {str(e)}")
         raise
 
-def save_audio(recording, samplerate):
-    """Save audio recording to file"""
+def stop_audio_stream(recorder):
+    """Stop the audio stream and return the recorded blocks"""
+    logger.info("Stopping audio stream recording")
+    recorder['stream'].stop()
+    recorder['stream'].close()
+    return recorder['blocks']
+
+def save_audio(blocks, samplerate):
+    """Save recorded audio blocks to file"""
     logger.info("Saving audio recording")
     try:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"recordings/audio_{timestamp}.wav"
-        sf.write(filename, recording, samplerate)
+        # Write block by block rather than concatenating the whole recording
+        with sf.SoundFile(filename, 'w', samplerate, config.AUDIO_CHANNELS, subtype='PCM_16') as f:
+            for block in blocks:
+                f.write(block)
         logger.info(f"Audio saved successfully: {filename}")
         return filename
     except Exception as e:
         logger.error(f"Error saving audio: {str(e)}")
         raise
 
+PRIORITY_COLORS = {
+    'high': 'background-color: #ffcccc',
+    'medium': 'background-color: #ffffcc',
+    'low': 'background-color: #ccffcc'
+}
+
+def normalize_mermaid_diagram(diagram_code):
+    """Make sure the diagram code starts with a graph header and has styling"""
+    # Ensure the diagram starts with graph TD
+    if not diagram_code.strip().startswith('graph'):
+        diagram_code = 'graph TD\n' + diagram_code
+    
+    # Add default styling if not present
+    if 'style' not in diagram_code:
+        diagram_code += """
+            style default fill:#f9f,stroke:#333,stroke-width:2px
+            style default fill:#bbf,stroke:#333,stroke-width:2px
+        """
+    return diagram_code
+
+def show_more_recordings():
+    """Show the next page of saved recordings"""
+    st.session_state['recordings_shown'] += config.RECORDINGS_PAGE_SIZE
+
 st.title("🎤 Smart Meeting Recorder & Analyzer")
 st.write("Record your meeting and get AI-powered insights!")
 
 
 if 'is_recording' not in st.session_state:
     st.session_state['is_recording'] = False
-if 'recording_started' not in st.session_state:
-    st.session_state['recording_started'] = False
-if 'start_time' not in st.session_state:
-    st.session_state['start_time'] = None
-if 'elapsed_time' not in st.session_state:
-    st.session_state['elapsed_time'] = None
 
 if 'recorder' not in st.session_state:
     st.session_state['recorder'] = None
@@ -156,8 +390,6 @@ col1, col2 = st.columns(2)
 with col1:
     if st.button("Start Recording") and not st.session_state['is_recording']:
         st.session_state['is_recording'] = True
-        st.session_state['start_time'] = time.time()
-        st.session_state['recording_started'] = True
         # Start recording
         st.session_state['recorder'] = record_audio_stream()
         st.info("🎙️ Recording... Click 'Stop Recording' when finished.")
@@ -166,29 +398,28 @@ with col2:
     if st.button("Stop Recording") and st.session_state['is_recording']:
         if st.session_state['recorder'] is not None:
             st.session_state['is_recording'] = False
-            st.session_state['elapsed_time'] = time.time() - st.session_state['start_time']
             
             # Stop recording and get the data
-            sd.stop()
-            recording = st.session_state['recorder'][:int(st.session_state['elapsed_time'] * 44100)]
+            recording = stop_audio_stream(st.session_state['recorder'])
             
             # Save the recording
-            audio_file = save_audio(recording, 44100)
+            audio_file = save_audio(recording, config.AUDIO_SAMPLE_RATE)
             st.session_state['last_recording'] = audio_file
-            st.success("Recording saved!")
+            # Duration from the samples actually saved rather than wall-clock time
+            minutes, seconds = divmod(int(sum(len(block) for block in recording) / config.AUDIO_SAMPLE_RATE), 60)
+            st.success(f"Recording saved! ({minutes}:{seconds:02d})")
             
             # Process the recording
             with st.spinner("Transcribing audio..."):
-                #result = model.transcribe(audio_file)
-                with open(audio_file, "rb") as audio_bits:
-                    result = client.audio.transcriptions.create(model="whisper-1", file=audio_bits, response_format="text")
-                    transcript = result["text"]
-                    st.session_state['last_transcription'] = transcript
+                audio_key = audio_hash(audio_file)
+                transcript = transcribe_audio(audio_file, audio_key)
+                st.session_state['last_transcription'] = transcript
             
             with st.spinner("Analyzing meeting content..."):
                 try:
                     analysis = generate_meeting_summary(transcript)
-                    analysis_dict = eval(analysis)
+                    analysis_dict = json.loads(analysis)
+                    save_cached_analysis(audio_key, analysis_dict)
                     st.session_state['last_analysis'] = analysis_dict
                 except Exception as e:
                     st.error(f"Error analyzing meeting content: {str(e)}")
@@ -234,33 +465,18 @@ if 'last_analysis' in st.session_state and st.session_state['last_analysis']:
     
     if action_items_df:
         df = pd.DataFrame(action_items_df)
-        # Apply color coding based on priority
-        def color_priority(val):
-            colors = {
-                'high': 'background-color: #ffcccc',
-                'medium': 'background-color: #ffffcc',
-                'low': 'background-color: #ccffcc'
-            }
-            return colors.get(val.lower(), '')
+        # Apply color coding based on priority, one vectorized lookup per column
+        def color_priority(column):
+            return column.str.lower().map(PRIORITY_COLORS).fillna('')
         
-        st.dataframe(df.style.applymap(color_priority, subset=['Priority']), use_container_width=True)
+        st.dataframe(df.style.apply(color_priority, subset=['Priority']), use_container_width=True)
     
     # Visual Flow Diagram
     st.subheader("🔄 Meeting Flow Visualization")
     with st.expander("Meeting Flow Diagram", expanded=True):
         try:
-            # Ensure the diagram starts with graph TD
-            diagram_code = analysis['mermaid_diagram']
-            print("diagram_code", diagram_code)
-            if not diagram_code.strip().startswith('graph'):
-                diagram_code = 'graph TD\n' + diagram_code
-            
-            # Add default styling if not present
-            if 'style' not in diagram_code:
-                diagram_code += """
-                    style default fill:#f9f,stroke:#333,stroke-width:2px
-                    style default fill:#bbf,stroke:#333,stroke-width:2px
-                """
+            diagram_code = normalize_mermaid_diagram(analysis['mermaid_diagram'])
+            logger.debug(f"diagram_code {diagram_code}")
             
             st_mermaid(diagram_code, height=600)
             
@@ -297,12 +513,56 @@ if 'last_recording' in st.session_state:
 
 # Display saved recordings
 with st.expander("📼 Saved Recordings", expanded=False):
-    saved_recordings = [f for f in os.listdir("recordings") if f.endswith(".wav")]
-    saved_recordings.sort(reverse=True)
+    # One scandir pass, newest first by modification time
+    with os.scandir("recordings") as entries:
+        wav_entries = [entry for entry in entries if entry.is_file() and entry.name.endswith(".wav")]
+    wav_entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    saved_recordings = [entry.name for entry in wav_entries]
 
-    for recording in saved_recordings:
+    if 'recording_analyses' not in st.session_state:
+        st.session_state['recording_analyses'] = {}
+    if 'recordings_shown' not in st.session_state:
+        st.session_state['recordings_shown'] = config.RECORDINGS_PAGE_SIZE
+
+    ignore_cache = st.checkbox("Ignore cached analyses", key="ignore_analysis_cache")
+    if saved_recordings and st.button("Analyze all"):
+        with st.spinner("Transcribing saved recordings..."):
+            keys = [audio_hash(f"recordings/{recording}") for recording in saved_recordings]
+            transcripts = [transcribe_audio(f"recordings/{recording}", key)
+                           for recording, key in zip(saved_recordings, keys)]
+        # Only send recordings without an up-to-date cached analysis to the API
+        if ignore_cache:
+            analyses = [None] * len(keys)
+        else:
+            analyses = [load_cached_analysis(key) for key in keys]
+        pending = [idx for idx, cached_analysis in enumerate(analyses) if cached_analysis is None]
+        if pending:
+            with st.spinner("Analyzing saved recordings..."):
+                fresh = asyncio.run(analyze_many([transcripts[idx] for idx in pending]))
+            for idx, recording_analysis in zip(pending, fresh):
+                analyses[idx] = recording_analysis
+                if recording_analysis is not None:
+                    save_cached_analysis(keys[idx], recording_analysis)
+        for recording, recording_analysis in zip(saved_recordings, analyses):
+            if recording_analysis is not None:
+                st.session_state['recording_analyses'][recording] = recording_analysis
+        failed = analyses.count(None)
+        if failed:
+            st.error(f"Error analyzing {failed} of {len(analyses)} recordings")
+        else:
+            st.success("Analysis complete!")
+
+    for recording in saved_recordings[:st.session_state['recordings_shown']]:
         col1, col2 = st.columns([3, 1])
-        with col1:
-            st.audio(f"recordings/{recording}")
         with col2:
-            st.write(recording) 
\ No newline at end of file
+            st.write(recording)
+            play = st.toggle("Play", key=f"play_{recording}")
+        with col1:
+            # Only stream the audio to the browser once the row is opened
+            if play:
+                st.audio(f"recordings/{recording}")
+        if recording in st.session_state['recording_analyses']:
+            st.caption(st.session_state['recording_analyses'][recording]['executive_summary'])
+
+    if len(saved_recordings) > st.session_state['recordings_shown']:
+        st.button("Load more", on_click=show_more_recordings) 
\ No newline at end of file
@@ -7,16 +7,43 @@ BASE_DIR = Path(__file__).resolve().parent
 # Directory for recordings
 RECORDINGS_DIR = BASE_DIR / "recordings"
 
+# Directory for cached transcripts and analyses, keyed by audio hash
+CACHE_DIR = RECORDINGS_DIR / ".cache"
+
+# Number of saved recordings listed per page
+RECORDINGS_PAGE_SIZE = 10
+
 # Create necessary directories
 RECORDINGS_DIR.mkdir(exist_ok=True)
+CACHE_DIR.mkdir(exist_ok=True)
 
-# Whisper model configuration
+# Whisper model configuration (faster-whisper / CTranslate2)
 WHISPER_MODEL = "base"
+WHISPER_CPU_COMPUTE_TYPE = "int8"
+WHISPER_GPU_COMPUTE_TYPE = "float16"
+# CPU threads: 0 defers to OMP_NUM_THREADS when it is set, otherwise use the
+# cores this process is allowed to run on rather than every host core
+if os.environ.get("OMP_NUM_THREADS"):
+    WHISPER_CPU_THREADS = 0
+elif hasattr(os, "sched_getaffinity"):
+    WHISPER_CPU_THREADS = len(os.sched_getaffinity(0))
+else:
+    WHISPER_CPU_THREADS = os.cpu_count() or 4
+WHISPER_BEAM_SIZE = 1
+WHISPER_BATCH_SIZE = 16
 
 # Audio recording configuration
-AUDIO_SAMPLE_RATE = 44100
+AUDIO_SAMPLE_RATE = 16000
 AUDIO_CHANNELS = 1
+AUDIO_BLOCK_SIZE = 1600  # 100 ms per block at 16 kHz
 MAX_RECORDING_HOURS = 1
 
 # OpenAI configuration
-GPT_MODEL = "gpt-4o" 
\ No newline at end of file
+GPT_MODEL = "gpt-4o"
+OPENAI_MAX_CONCURRENT_REQUESTS = 10
+SUMMARY_BATCH_SIZE = 4
+SUMMARY_SEED = 0
+STREAM_RENDER_INTERVAL = 0.1  # seconds between streamed summary redraws
+
+# Transcripts under this many words get the compact summary prompt
+SHORT_TRANSCRIPT_WORDS = 200